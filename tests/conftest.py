@@ -0,0 +1,5 @@
+import os
+import sys
+
+# watermark_tool is a single script next to this folder, not an installed package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,290 @@
+"""Per-pixel originals of the render functions, for test_equivalence"""
+
+import os
+import random
+
+from PIL import Image, ImageDraw, ImageFont
+
+try:
+    import piexif
+except ImportError:
+    piexif = None
+
+
+def reference_convert_dark_to_white(logo_img):
+    """Per-pixel original of convert_dark_to_white"""
+    logo = logo_img.convert('RGBA')
+    pixels = logo.load()
+    
+    for y in range(logo.height):
+        for x in range(logo.width):
+            r, g, b, a = pixels[x, y]
+            
+            if a == 0:  # Skip transparent pixels
+                continue
+            
+            brightness = (r + g + b) / 3
+            
+            if brightness < 128:  # Darker than 50% gray
+                pixels[x, y] = (255, 255, 255, a)
+    
+    return logo
+
+
+def reference_convert_dark_to_black(logo_img):
+    """Per-pixel original of convert_dark_to_black"""
+    logo = logo_img.convert('RGBA')
+    pixels = logo.load()
+    
+    for y in range(logo.height):
+        for x in range(logo.width):
+            r, g, b, a = pixels[x, y]
+            
+            if a == 0:  # Skip transparent pixels
+                continue
+            
+            brightness = (r + g + b) / 3
+            
+            if brightness >= 128:  # Lighter than 50% gray
+                pixels[x, y] = (0, 0, 0, a)
+    
+    return logo
+
+
+def reference_make_logo_sprites(logo, color, outline_color, logo_alpha):
+    """Per-pixel original of make_logo_sprites"""
+    outline_alpha = logo_alpha // 2
+    logo_main = Image.new('RGBA', logo.size, (0, 0, 0, 0))
+    logo_outline = Image.new('RGBA', logo.size, (0, 0, 0, 0))
+    
+    for y in range(logo.height):
+        for x in range(logo.width):
+            r, g, b, a = logo.getpixel((x, y))
+            if a > 0:
+                new_alpha = int(a * outline_alpha / 255)
+                logo_outline.putpixel((x, y), outline_color + (new_alpha,))
+                
+                new_alpha = int(a * logo_alpha / 255)
+                logo_main.putpixel((x, y), color + (new_alpha,))
+    
+    return logo_main, logo_outline
+
+
+def reference_add_watermark(image_path, output_path, config):
+    """The original add_watermark, verbatim"""
+    
+    # Load image
+    img = Image.open(image_path)
+    
+    # Convert to RGBA for transparency support
+    if img.mode != 'RGBA':
+        img = img.convert('RGBA')
+    
+    # Create transparent overlay layer
+    overlay = Image.new('RGBA', img.size, (0, 0, 0, 0))
+    draw = ImageDraw.Draw(overlay)
+    
+    # Load font
+    try:
+        font_paths = [
+            "/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf",
+            "/usr/share/fonts/truetype/liberation/LiberationSans-Bold.ttf",
+            "/System/Library/Fonts/Helvetica.ttc",
+            "C:\\Windows\\Fonts\\arialbd.ttf",
+        ]
+        font_path = None
+        for path in font_paths:
+            if os.path.exists(path):
+                font_path = path
+                break
+        
+        font_size = int(min(img.width, img.height) * 0.04)
+        
+        if font_path:
+            font = ImageFont.truetype(font_path, font_size)
+        else:
+            font = ImageFont.load_default()
+            print("  ⚠ Using default font (no system fonts found)")
+    except Exception as e:
+        font = ImageFont.load_default()
+        print(f"  ⚠ Font loading error: {e}")
+    
+    # Auto-convert (c) or (C) to © symbol
+    watermark_text = config['text'].replace('(c)', '©').replace('(C)', '©')
+    
+    # Calculate text dimensions
+    bbox = draw.textbbox((0, 0), watermark_text, font=font)
+    text_width = bbox[2] - bbox[0]
+    text_height = bbox[3] - bbox[1]
+    
+    # Padding for overlap detection
+    padding = int(max(text_width, text_height) * 0.2)
+    
+    # Overlap detection function
+    def rectangles_overlap(box1, box2):
+        x1, y1, x2, y2 = box1
+        x3, y3, x4, y4 = box2
+        return not (x2 < x3 or x4 < x1 or y2 < y3 or y4 < y1)
+    
+    # Generate positions with overlap prevention
+    positions = []
+    placed_boxes = []
+    overlap_warnings = 0
+    
+    for i in range(config['count']):
+        placed = False
+        max_attempts = 50
+        
+        for attempt in range(max_attempts):
+            # Density-weighted random position (more in center)
+            x_ratio = random.betavariate(2, 2)
+            y_ratio = random.betavariate(2, 2)
+            x = int(x_ratio * (img.width - text_width))
+            y = int(y_ratio * (img.height - text_height))
+            
+            candidate_box = (
+                x - padding,
+                y - padding,
+                x + text_width + padding,
+                y + text_height + padding
+            )
+            
+            # Check for overlaps
+            overlaps = False
+            for existing_box in placed_boxes:
+                if rectangles_overlap(candidate_box, existing_box):
+                    overlaps = True
+                    break
+            
+            if not overlaps:
+                positions.append((x, y))
+                placed_boxes.append(candidate_box)
+                placed = True
+                break
+        
+        # If couldn't find clear space, place anyway
+        if not placed:
+            positions.append((x, y))
+            placed_boxes.append(candidate_box)
+            overlap_warnings += 1
+    
+    if overlap_warnings > 0:
+        print(f"  ⚠ {overlap_warnings} watermark(s) placed with potential overlap (limited space)")
+    
+    # Choose colors based on config
+    use_white = config['color'] == 'white'
+    
+    if use_white:
+        text_color = (255, 255, 255)
+        outline_color_base = (0, 0, 0)
+    else:
+        text_color = (0, 0, 0)
+        outline_color_base = (255, 255, 255)
+    
+    # Draw text watermarks
+    text_alpha = int(255 * config['text_opacity'] / 100)
+    
+    for pos in positions:
+        # Outline (half opacity)
+        outline_alpha = text_alpha // 2
+        outline_color = outline_color_base + (outline_alpha,)
+        
+        for offset in [(1, 1), (-1, -1), (1, -1), (-1, 1)]:
+            outline_pos = (pos[0] + offset[0], pos[1] + offset[1])
+            draw.text(outline_pos, watermark_text, font=font, fill=outline_color)
+        
+        # Main text
+        main_color = text_color + (text_alpha,)
+        draw.text(pos, watermark_text, font=font, fill=main_color)
+    
+    # Add logo if specified
+    if config.get('logo_path') and os.path.exists(config['logo_path']):
+        try:
+            logo = Image.open(config['logo_path']).convert("RGBA")
+            
+            # Convert logo color based on choice
+            if use_white:
+                logo = reference_convert_dark_to_white(logo)
+            else:
+                logo = reference_convert_dark_to_black(logo)
+            
+            # Resize logo
+            max_logo_width = int(img.width * 0.15)
+            if logo.width > max_logo_width:
+                ratio = max_logo_width / logo.width
+                new_size = (max_logo_width, int(logo.height * ratio))
+                logo = logo.resize(new_size, Image.Resampling.LANCZOS)
+            
+            # Position logo
+            logo_position = config.get('logo_position', 'bottom-right')
+            padding = int(min(img.width, img.height) * 0.02)
+            
+            if logo_position == 'bottom-right':
+                logo_x = img.width - logo.width - padding
+                logo_y = img.height - logo.height - padding
+            elif logo_position == 'bottom-left':
+                logo_x = padding
+                logo_y = img.height - logo.height - padding
+            elif logo_position == 'top-right':
+                logo_x = img.width - logo.width - padding
+                logo_y = padding
+            elif logo_position == 'top-left':
+                logo_x = padding
+                logo_y = padding
+            else:
+                logo_x = img.width - logo.width - padding
+                logo_y = img.height - logo.height - padding
+            
+            # Apply logo opacity
+            logo_alpha = int(255 * config['logo_opacity'] / 100)
+            outline_alpha = logo_alpha // 2
+            
+            # Draw logo outline (4 positions like text)
+            for offset in [(1, 1), (-1, -1), (1, -1), (-1, 1)]:
+                offset_x = logo_x + offset[0]
+                offset_y = logo_y + offset[1]
+                
+                logo_outline = Image.new('RGBA', logo.size, (0, 0, 0, 0))
+                for y in range(logo.height):
+                    for x in range(logo.width):
+                        r, g, b, a = logo.getpixel((x, y))
+                        if a > 0:
+                            new_alpha = int(a * outline_alpha / 255)
+                            logo_outline.putpixel((x, y), outline_color_base + (new_alpha,))
+                
+                overlay.paste(logo_outline, (offset_x, offset_y), logo_outline)
+            
+            # Draw main logo
+            logo_main = Image.new('RGBA', logo.size, (0, 0, 0, 0))
+            for y in range(logo.height):
+                for x in range(logo.width):
+                    r, g, b, a = logo.getpixel((x, y))
+                    if a > 0:
+                        new_alpha = int(a * logo_alpha / 255)
+                        logo_main.putpixel((x, y), text_color + (new_alpha,))
+            
+            overlay.paste(logo_main, (logo_x, logo_y), logo_main)
+            
+        except Exception as e:
+            print(f"  ⚠ Logo error: {e}")
+    
+    # Composite overlay onto original image (PROPER TRANSPARENCY!)
+    result = Image.alpha_composite(img, overlay)
+    
+    # Convert back to original mode for saving
+    if image_path.lower().endswith(('.jpg', '.jpeg')):
+        result = result.convert('RGB')
+    
+    # Add EXIF metadata if available
+    if piexif and config.get('metadata'):
+        try:
+            exif_dict = {"0th": {}, "Exif": {}, "GPS": {}, "1st": {}, "thumbnail": None}
+            exif_dict["0th"][piexif.ImageIFD.Copyright] = config['metadata'].encode('utf-8')
+            exif_bytes = piexif.dump(exif_dict)
+            result.save(output_path, exif=exif_bytes, quality=95)
+        except:
+            result.save(output_path, quality=95)
+    else:
+        result.save(output_path, quality=95)
+    
+    return True
@@ -0,0 +1,72 @@
+"""Animated and multipage images keep every frame and its timing"""
+
+import pytest
+from PIL import Image, ImageSequence
+
+import watermark_tool
+
+CONFIG = {'text': '(c) Frames', 'count': 2, 'text_opacity': 30, 'color': 'white'}
+DURATIONS = [100, 200, 300]
+
+
+@pytest.fixture
+def animation(tmp_path):
+    path = tmp_path / 'anim.gif'
+    frames = [Image.new('RGB', (160, 120), color) for color in ('red', 'green', 'blue')]
+    frames[0].save(path, save_all=True, append_images=frames[1:], duration=DURATIONS, loop=0)
+    return path
+
+
+@pytest.mark.parametrize('ext', ('.gif', '.png', '.webp'))
+def test_frames_and_durations_kept(tmp_path, animation, ext):
+    output_path = tmp_path / ('out' + ext)
+    watermark_tool.add_watermark(str(animation), str(output_path), CONFIG)
+    with Image.open(output_path) as result:
+        assert result.info['loop'] == 0
+        durations = []
+        for channel, frame in enumerate(ImageSequence.Iterator(result)):
+            pixel = frame.convert('RGB').getpixel((0, 0))
+            durations.append(frame.info['duration'])
+            assert pixel.index(max(pixel)) == channel
+        assert durations == DURATIONS
+
+
+def test_multipage_tiff(tmp_path, animation):
+    output_path = tmp_path / 'out.tif'
+    watermark_tool.add_watermark(str(animation), str(output_path), CONFIG)
+    with Image.open(output_path) as result:
+        assert result.n_frames == 3
+
+
+def test_single_frame_format_gets_first_frame(tmp_path, animation, capsys):
+    output_path = tmp_path / 'out.jpg'
+    watermark_tool.add_watermark(str(animation), str(output_path), CONFIG)
+    with Image.open(output_path) as result:
+        assert getattr(result, 'n_frames', 1) == 1
+        red, green, blue = result.getpixel((0, 0))
+        assert red > 200 and green < 60 and blue < 60
+    assert "saving the first frame only" in capsys.readouterr().out
+
+
+def test_invisible_mark_skipped_with_warning(tmp_path, animation, capsys):
+    pytest.importorskip('numpy')
+    watermark_tool.add_watermark(str(animation), str(tmp_path / 'out.gif'), dict(CONFIG, invisible=True))
+    assert "invisible watermark is only added to still images" in capsys.readouterr().out
+
+
+def test_animated_webp_target_size(tmp_path, capsys):
+    source = tmp_path / 'noise.gif'
+    frames = [Image.effect_noise((320, 240), sigma).convert('RGB') for sigma in (40, 60, 80)]
+    frames[0].save(source, save_all=True, append_images=frames[1:], duration=DURATIONS, loop=0)
+    output_path = tmp_path / 'out.webp'
+
+    watermark_tool.add_watermark(str(source), str(output_path), dict(CONFIG, target_size=40 * 1024))
+    assert output_path.stat().st_size <= 40 * 1024
+    assert "out.webp: quality" in capsys.readouterr().out
+    with Image.open(output_path) as result:
+        assert result.n_frames == 3
+        durations = []
+        for frame in ImageSequence.Iterator(result):
+            frame.convert('RGB')
+            durations.append(frame.info['duration'])
+        assert durations == DURATIONS
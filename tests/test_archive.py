@@ -0,0 +1,100 @@
+"""Zip and tar outputs written through ArchiveOutput"""
+
+import io
+import json
+import tarfile
+import zipfile
+
+import pytest
+from PIL import Image
+
+import watermark_tool
+
+CONFIG = {'text': '(c) Archive', 'count': 3, 'text_opacity': 30, 'color': 'white'}
+
+
+@pytest.fixture
+def input_folder(tmp_path):
+    folder = tmp_path / 'in'
+    (folder / 'sub').mkdir(parents=True)
+    Image.new('RGB', (160, 120), (200, 40, 40)).save(folder / 'a.jpg')
+    Image.new('RGBA', (90, 140), (20, 90, 200, 128)).save(folder / 'sub' / 'b.png')
+    return folder
+
+
+def members(path):
+    """{member name: image size} of a finished archive"""
+    if path.endswith('.zip'):
+        with zipfile.ZipFile(path) as archive:
+            return {name: Image.open(io.BytesIO(archive.read(name))).size
+                    for name in archive.namelist()}
+    with tarfile.open(path) as archive:
+        return {member.name: Image.open(io.BytesIO(archive.extractfile(member).read())).size
+                for member in archive}
+
+
+def write_template(folder):
+    path = folder / 'template.json'
+    path.write_text(json.dumps(CONFIG))
+    return path
+
+
+@pytest.mark.parametrize('name, compression', (('out.zip', 'stored'), ('out.zip', 'deflated'),
+                                               ('out.tar', 'stored'), ('out.tar.gz', 'stored')))
+def test_batch_into_archive(tmp_path, input_folder, name, compression):
+    path = str(tmp_path / name)
+    output = watermark_tool.ArchiveOutput(path, compression)
+    report = watermark_tool.run_batch(str(input_folder), output, CONFIG,
+                                      watermark_tool.find_image_files(str(input_folder), recursive=True))
+    assert not (tmp_path / name).exists()
+    output.close()
+
+    assert report['successful'] == 2
+    assert members(path) == {'a_watermarked.jpg': (160, 120), 'sub/b_watermarked.png': (90, 140)}
+    assert not (tmp_path / (name + '.partial')).exists()
+
+
+def test_archive_to_archive(tmp_path, input_folder):
+    source = str(tmp_path / 'in.tar')
+    with tarfile.open(source, 'w') as archive:
+        archive.add(input_folder / 'a.jpg', 'photos/a.jpg')
+        archive.add(input_folder / 'sub' / 'b.png', '../b.png')
+
+    path = str(tmp_path / 'out.zip')
+    output = watermark_tool.ArchiveOutput(path)
+    report = watermark_tool.run_archive_batch(source, output, CONFIG)
+    output.close()
+
+    # The member that would escape the output is skipped
+    assert (report['total'], report['successful']) == (1, 1)
+    assert members(path) == {'photos/a_watermarked.jpg': (160, 120)}
+
+
+def test_failed_run_removes_partial(tmp_path, input_folder, monkeypatch):
+    def fail(*args):
+        raise KeyboardInterrupt
+    monkeypatch.setattr(watermark_tool, 'add_watermark', fail)
+    path = str(tmp_path / 'out.zip')
+    with pytest.raises(KeyboardInterrupt):
+        with watermark_tool.ArchiveOutput(path) as output:
+            watermark_tool.run_batch(str(input_folder), output, CONFIG)
+    assert list(tmp_path.glob('out.zip*')) == []
+
+
+def test_plan_starts_no_archive(tmp_path, input_folder):
+    watermark_tool.main(['--template', str(write_template(tmp_path)), '--input', str(input_folder),
+                         '--output', str(tmp_path / 'out.zip'), '--plan'])
+    assert list(tmp_path.glob('out.zip*')) == []
+
+
+def test_retry_without_metadata_starts_over(monkeypatch):
+    # PNG writes its signature before it trips over the bad EXIF
+    monkeypatch.setattr(watermark_tool, 'metadata_options', lambda *args: {'exif': 12345})
+    image = Image.new('RGB', (40, 30), 'green')
+    buffer = io.BytesIO()
+    buffer.name = 'a_watermarked.png'
+    watermark_tool.save_watermarked(image, buffer, CONFIG)
+
+    clean = io.BytesIO()
+    image.save(clean, 'PNG')
+    assert buffer.getvalue() == clean.getvalue()
@@ -0,0 +1,68 @@
+"""Compiled template bundles round-trip and reject tampered contents"""
+
+import zipfile
+
+import pytest
+from PIL import Image
+
+import watermark_tool
+
+CONFIG = {'text': '(c) Bundle', 'count': 3, 'text_opacity': 30, 'color': 'auto', 'logo_opacity': 50}
+
+
+@pytest.fixture
+def bundle_path(tmp_path):
+    logo_path = tmp_path / 'logo.png'
+    Image.new('RGBA', (64, 32), (0, 0, 0, 255)).save(logo_path)
+    path = tmp_path / ('template' + watermark_tool.BUNDLE_EXTENSION)
+    watermark_tool.save_template_bundle(dict(CONFIG, logo_path=str(logo_path)), str(path))
+    return path
+
+
+def test_sprites_round_trip(bundle_path):
+    config = watermark_tool.load_template(str(bundle_path))
+    with zipfile.ZipFile(bundle_path) as bundle:
+        for levels in config['_bundle']['sprites'].values():
+            assert [level[0].width for level in levels] == [64, 32, 16]
+        main, outline = config['_bundle']['sprites']['white'][0]
+        assert main.tobytes() == bundle.read('sprites/white_64_main.rgba')
+        assert outline.tobytes() == bundle.read('sprites/white_64_outline.rgba')
+
+
+def test_tampered_sprite_rejected(tmp_path, bundle_path):
+    tampered = tmp_path / ('tampered' + watermark_tool.BUNDLE_EXTENSION)
+    with zipfile.ZipFile(bundle_path) as source, zipfile.ZipFile(tampered, 'w') as target:
+        for info in source.infolist():
+            data = source.read(info)
+            if info.filename == 'sprites/black_32_main.rgba':
+                data = bytes([data[0] ^ 0xff]) + data[1:]
+            target.writestr(info, data)
+    with pytest.raises(ValueError, match='hash mismatch'):
+        watermark_tool.load_template(str(tampered))
+
+
+def test_workers_load_bundle_from_file(tmp_path, bundle_path):
+    config = watermark_tool.load_template(str(bundle_path))
+    template = watermark_tool.worker_template([(config, 'out')])[0][0]
+    assert '_bundle' not in template
+    assert template['_bundle_file'] == (str(bundle_path), config['_bundle']['hash'])
+
+    loaded = watermark_tool.load_worker_template(template)
+    assert loaded['_bundle']['hash'] == config['_bundle']['hash']
+    assert '_bundle_file' not in loaded
+
+    input_folder = tmp_path / 'in'
+    input_folder.mkdir()
+    for name in ('a.jpg', 'b.jpg'):
+        Image.new('RGB', (400, 300), 'red').save(input_folder / name)
+    (tmp_path / 'out').mkdir()
+    results = watermark_tool.run_parallel(str(input_folder), str(tmp_path / 'out'), config,
+                                          ['a.jpg', 'b.jpg'], 2, 2 * 1024 ** 3)
+    assert sorted((filename, error) for filename, _, error, _ in results) == [('a.jpg', None), ('b.jpg', None)]
+
+
+def test_changed_bundle_refused_by_workers(tmp_path, bundle_path):
+    template = watermark_tool.worker_template(watermark_tool.load_template(str(bundle_path)))
+    watermark_tool.save_template_bundle(dict(CONFIG, text='(c) Changed'), str(bundle_path))
+    with pytest.raises(ValueError, match='changed since the run started'):
+        watermark_tool.load_worker_template(template)
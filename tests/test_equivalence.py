@@ -0,0 +1,155 @@
+"""The optimized render paths against their per-pixel originals in reference.py"""
+
+import io
+import random
+import contextlib
+
+import pytest
+from PIL import Image, ImageChops
+
+import watermark_tool
+import reference
+
+SEED = 20250813
+MODES = ('RGB', 'RGBA', 'L', 'P')
+LOGO_SIZES = ((1, 1), (3, 7), (17, 33), (101, 57), (255, 3))
+IMAGE_SIZES = ((333, 251), (97, 401), (641, 479))
+FORMATS = ('.png', '.gif')
+
+# Channel values on both sides of the 50% gray threshold, mixed into the noise
+EDGE_VALUES = (0, 1, 127, 128, 129, 254, 255)
+
+# Share of pixels in a palette output that may be mapped to something other
+# than the palette entry nearest to the reference composite, per source mode
+# and output format. RGB and RGBA sources are quantized with MEDIANCUT,
+# which maps every pixel to its nearest entry. Palette sources keep their
+# transparent index: in GIF output, pixels the watermark made half
+# transparent must become opaque or clear (up to 0.012% of the noise
+# photos), and PNG output is quantized with FASTOCTREE, which maps by
+# octree leaf rather than distance (up to 6.2% of the noise photos).
+PALETTE_TOLERANCES = {
+    ('RGB', '.gif'): 0.0,
+    ('RGBA', '.gif'): 0.0,
+    ('P', '.gif'): 0.0005,
+    ('P', '.png'): 0.07,
+}
+
+
+def noise_image(rng, mode, size, edge_values=False):
+    """Seeded noise image; P images get a random palette and a transparent index"""
+    count = size[0] * size[1] * Image.getmodebands(mode)
+    if edge_values:
+        data = bytes(rng.choice(EDGE_VALUES) if rng.random() < 0.5 else rng.randrange(256)
+                     for _ in range(count))
+    else:
+        data = rng.randbytes(count)
+    image = Image.frombytes(mode, size, data)
+    if mode == 'P':
+        image.putpalette(rng.randbytes(768))
+        image.info['transparency'] = 0
+    return image
+
+
+def logo_cases():
+    rng = random.Random(SEED)
+    return [pytest.param(noise_image(rng, mode, size, True), id=f"{mode}-{size[0]}x{size[1]}")
+            for mode in MODES + ('LA',) for size in LOGO_SIZES]
+
+
+def photo_cases():
+    rng = random.Random(SEED + 1)
+    return [pytest.param(mode, noise_image(rng, mode, size), ext, id=f"{mode}-{size[0]}x{size[1]}-{ext[1:]}")
+            for mode in MODES for size in IMAGE_SIZES for ext in FORMATS]
+
+
+def difference(first, second):
+    """Largest per-channel difference between two images of the same size and mode"""
+    assert (first.mode, first.size) == (second.mode, second.size)
+    extrema = ImageChops.difference(first, second).getextrema()
+    if not isinstance(extrema[0], tuple):
+        extrema = (extrema,)
+    return max(high for low, high in extrema)
+
+
+def off_nearest(composite, result):
+    """Share of pixels in a palette result that aren't the palette entry nearest to composite
+
+    Colors are compared premultiplied, so whatever color a transparent
+    pixel carries doesn't count.
+    """
+    np = pytest.importorskip('numpy')
+
+    def pixels(image):
+        values = np.asarray(image.convert('RGBA'), dtype=np.int32).reshape(-1, 4)
+        values[values[:, 3] == 0] = 0
+        return values
+
+    want, got = pixels(composite), pixels(result)
+    palette = np.unique(got, axis=0)
+    worse = 0
+    for start in range(0, len(want), 16384):
+        chunk = want[start:start + 16384]
+        nearest = ((chunk[:, None, :] - palette[None, :, :]) ** 2).sum(axis=2).min(axis=1)
+        worse += int((((chunk - got[start:start + 16384]) ** 2).sum(axis=1) > nearest).sum())
+    return worse / len(want)
+
+
+@pytest.fixture
+def e2e_logo(tmp_path):
+    """Logo for the end-to-end runs: transparent background around noisy content"""
+    logo = Image.new('RGBA', (121, 61), (0, 0, 0, 0))
+    logo.paste(noise_image(random.Random(SEED + 2), 'RGBA', (101, 41), True), (10, 10))
+    logo_path = tmp_path / 'logo.png'
+    logo.save(logo_path)
+    return str(logo_path)
+
+
+def render(function, photo_path, output_path, config):
+    """Run one add_watermark from empty caches and a fixed seed; the output, loaded"""
+    watermark_tool.render_caches().clear()
+    random.seed(SEED)
+    with contextlib.redirect_stdout(io.StringIO()):
+        function(str(photo_path), str(output_path), config)
+    with Image.open(output_path) as result:
+        return result.copy()
+
+
+@pytest.mark.parametrize('logo', logo_cases())
+def test_convert_dark(logo):
+    assert difference(reference.reference_convert_dark_to_white(logo),
+                      watermark_tool.convert_dark_to_white(logo)) == 0
+    assert difference(reference.reference_convert_dark_to_black(logo),
+                      watermark_tool.convert_dark_to_black(logo)) == 0
+
+
+@pytest.mark.parametrize('logo', logo_cases())
+@pytest.mark.parametrize('logo_alpha', (0, 1, 76, 255))
+@pytest.mark.parametrize('use_white', (True, False))
+def test_make_logo_sprites(logo, logo_alpha, use_white):
+    recolored = reference.reference_convert_dark_to_white(logo)
+    colors = watermark_tool.watermark_colors(use_white)
+    expected = reference.reference_make_logo_sprites(recolored, *colors, logo_alpha)
+    actual = watermark_tool.make_logo_sprites(recolored, *colors, logo_alpha)
+    for want, got in zip(expected, actual):
+        assert difference(want, got) == 0
+
+
+@pytest.mark.parametrize('mode, photo, ext', photo_cases())
+@pytest.mark.parametrize('color, logo_position', (('white', 'bottom-right'), ('black', 'top-left')))
+def test_add_watermark(tmp_path, e2e_logo, mode, photo, ext, color, logo_position):
+    # The original only knows plain white and black templates
+    config = {'text': '(c) Equivalence', 'count': 5, 'text_opacity': 30, 'logo_opacity': 60,
+              'logo_path': e2e_logo, 'logo_position': logo_position, 'color': color}
+    photo_path = tmp_path / ('photo' + ext)
+    photo.save(photo_path)
+
+    # The original's PNG output is the lossless composite for any source
+    composite = render(reference.reference_add_watermark, photo_path, tmp_path / 'reference.png', config)
+    result = render(watermark_tool.add_watermark, photo_path, tmp_path / ('result' + ext), config)
+
+    assert result.size == composite.size
+    if result.mode == 'P':
+        assert off_nearest(composite, result) <= PALETTE_TOLERANCES[mode, ext]
+    else:
+        assert difference(composite.convert('RGBA').convert('RGBa'),
+                          result.convert('RGBA').convert('RGBa')) == 0
@@ -0,0 +1,25 @@
+"""Fan-out runs: one decode, one output tree per template"""
+
+import pytest
+from PIL import Image
+
+import watermark_tool
+
+CONFIG = {'text': '(c) Fanout', 'count': 3, 'text_opacity': 30, 'color': 'white'}
+
+
+@pytest.mark.parametrize('jobs', (1, 2))
+def test_image_skipped_by_every_template(tmp_path, capsys, jobs):
+    input_folder = tmp_path / 'in'
+    input_folder.mkdir()
+    Image.new('RGB', (160, 120), 'red').save(tmp_path / 'photo.png')
+    watermark_tool.add_watermark(str(tmp_path / 'photo.png'), str(input_folder / 'marked.png'), CONFIG)
+    Image.new('RGB', (160, 120), 'blue').save(input_folder / 'plain.png')
+
+    # The plan lets the marked file through; the template itself skips it
+    targets = [(CONFIG, str(tmp_path / 'out' / 'a'))]
+    report = watermark_tool.run_batch(str(input_folder), None, dict(CONFIG, _rewatermark=True),
+                                      ['marked.png', 'plain.png'], jobs=jobs, targets=targets)
+    assert (report['successful'], report['skipped'], report['failed']) == (1, 1, 0)
+    assert "✓ Saved: \n" not in capsys.readouterr().out
+    assert [path.name for path in (tmp_path / 'out' / 'a').iterdir()] == ['plain_watermarked.png']
@@ -0,0 +1,45 @@
+"""Isolated workers: killed jobs leave nothing behind, messages reach the parent"""
+
+import os
+import time
+import multiprocessing
+
+import pytest
+from PIL import Image
+
+import watermark_tool
+
+CONFIG = {'text': '(c) Isolated', 'count': 3, 'text_opacity': 30, 'color': 'white'}
+
+
+@pytest.fixture
+def input_folder(tmp_path):
+    folder = tmp_path / 'in'
+    folder.mkdir()
+    Image.effect_noise((400, 300), 80).convert('RGB').save(folder / 'photo.jpg')
+    (tmp_path / 'out').mkdir()
+    return folder
+
+
+@pytest.mark.skipif(multiprocessing.get_start_method() != 'fork',
+                    reason="the stalled save is patched into forked workers")
+def test_timeout_leaves_no_partial_file(tmp_path, input_folder, monkeypatch):
+    def stall(result, output_path, config):
+        output_path.write(b'\xff\xd8\xff partial')
+        output_path.flush()
+        time.sleep(60)
+    monkeypatch.setattr(watermark_tool, 'save_watermarked', stall)
+
+    results = list(watermark_tool.run_isolated(str(input_folder), str(tmp_path / 'out'), CONFIG,
+                                               ['photo.jpg'], timeout=1))
+    assert results[0][2].startswith('timed out')
+    assert os.listdir(tmp_path / 'out') == []
+
+
+def test_worker_messages_reach_parent(tmp_path, input_folder, capsys):
+    config = dict(CONFIG, target_size=1024)
+    results = list(watermark_tool.run_isolated(str(input_folder), str(tmp_path / 'out'), config,
+                                               ['photo.jpg']))
+    assert results[0][1:3] == (['photo_watermarked.jpg'], None)
+    assert "photo_watermarked.jpg: " in capsys.readouterr().out
+    assert os.listdir(tmp_path / 'out') == ['photo_watermarked.jpg']
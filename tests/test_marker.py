@@ -0,0 +1,29 @@
+"""Processing markers identifying the template that made an output"""
+
+from PIL import Image
+
+import watermark_tool
+
+
+def test_marker_hashes_logo_once(tmp_path, monkeypatch):
+    logo_path = tmp_path / 'logo.png'
+    Image.new('RGBA', (20, 10), (0, 0, 0, 255)).save(logo_path)
+    config = {'text': '(c) Marker', 'count': 3, 'text_opacity': 30, 'color': 'white',
+              'logo_path': str(logo_path), 'logo_opacity': 50}
+    hashes = []
+    template_hash = watermark_tool.template_hash
+    monkeypatch.setattr(watermark_tool, 'template_hash',
+                        lambda *args: hashes.append(args) or template_hash(*args))
+
+    marker = watermark_tool.template_marker(config)
+    for _ in range(3):
+        assert watermark_tool.template_marker(config) == marker
+        assert watermark_tool.metadata_options('a.gif', config) == {'comment': marker}
+    assert len(hashes) == 1
+
+    # Sizes and runtime settings don't change it; template settings do
+    assert watermark_tool.template_marker(dict(config, sizes=[400], _rewatermark=True)) == marker
+    changed = dict(config, text='(c) Other')
+    assert watermark_tool.template_marker(changed) != marker
+    config['count'] = 4
+    assert watermark_tool.template_marker(config) not in (marker, watermark_tool.template_marker(changed))
@@ -0,0 +1,35 @@
+"""--pipe writes nothing but the encoded image to stdout"""
+
+import sys
+import json
+import subprocess
+
+import pytest
+from PIL import Image
+
+import watermark_tool
+
+CONFIG = {'text': '(c) Pipe', 'count': 3, 'text_opacity': 30, 'color': 'white'}
+
+# Leading bytes of each --pipe output format
+PIPE_MAGIC = {
+    'png': (b'\x89PNG\r\n\x1a\n',),
+    'jpg': (b'\xff\xd8\xff',),
+    'webp': (b'RIFF',),
+    'gif': (b'GIF87a', b'GIF89a'),
+    'tiff': (b'II*\0', b'MM\0*'),
+}
+
+
+@pytest.mark.parametrize('image_format', sorted(PIPE_MAGIC))
+def test_pipe_output_is_clean(tmp_path, image_format):
+    template_path = tmp_path / 'template.json'
+    template_path.write_text(json.dumps(CONFIG))
+    photo_path = tmp_path / 'photo.jpg'
+    Image.new('RGB', (160, 120), (200, 40, 40)).save(photo_path)
+
+    with open(photo_path, 'rb') as f:
+        finished = subprocess.run([sys.executable, watermark_tool.__file__, '--template', str(template_path),
+                                   '--pipe', image_format], stdin=f, capture_output=True, timeout=300)
+    assert finished.returncode == 0, finished.stderr.decode(errors='replace')
+    assert finished.stdout.startswith(PIPE_MAGIC[image_format])
@@ -0,0 +1,46 @@
+"""Outputs read through the pixel cache match the ones decoded directly"""
+
+import io
+import random
+import contextlib
+
+import pytest
+from PIL import Image
+
+import watermark_tool
+
+CONFIG = {'text': '(c) Cache', 'count': 3, 'text_opacity': 30, 'color': 'white'}
+
+
+@pytest.fixture
+def photo(tmp_path):
+    path = tmp_path / 'photo.jpg'
+    Image.radial_gradient('L').resize((1600, 1200)).convert('RGB').save(path, quality=90)
+    return str(path)
+
+
+def render(photo, folder, config):
+    """Fan a photo out with a fixed seed; {filename: bytes} of what was saved"""
+    folder.mkdir()
+    random.seed(1)
+    with contextlib.redirect_stdout(io.StringIO()):
+        watermark_tool.add_watermark_fanout(photo, [(config, str(folder))])
+    return {path.name: path.read_bytes() for path in folder.iterdir()}
+
+
+@pytest.mark.parametrize('sizes', (['full', 400], [400]))
+def test_cached_outputs_match(tmp_path, photo, sizes):
+    config = dict(CONFIG, sizes=sizes)
+    cached = dict(config, _pixel_cache=(str(tmp_path / 'cache'), watermark_tool.PIXEL_CACHE_SIZE))
+    direct = render(photo, tmp_path / 'direct', config)
+    assert render(photo, tmp_path / 'miss', cached) == direct
+    assert render(photo, tmp_path / 'hit', cached) == direct
+
+
+def test_entries_keyed_by_pillow_version(tmp_path, photo, monkeypatch):
+    settings = (str(tmp_path / 'cache'), watermark_tool.PIXEL_CACHE_SIZE)
+    config = dict(CONFIG, _pixel_cache=settings)
+    watermark_tool.open_source(photo, config)
+    monkeypatch.setattr(Image, '__version__', '0.0.0')
+    watermark_tool.open_source(photo, config)
+    assert len(list((tmp_path / 'cache').glob('*/*.px'))) == 2
@@ -0,0 +1,52 @@
+"""Batch planning: header scan, order and the opt-in calibration"""
+
+import pytest
+from PIL import Image
+
+import watermark_tool
+
+CONFIG = {'text': '(c) Plan', 'count': 3, 'text_opacity': 30, 'color': 'white'}
+
+
+@pytest.fixture
+def input_folder(tmp_path):
+    folder = tmp_path / 'in'
+    folder.mkdir()
+    Image.new('RGB', (300, 200), 'red').save(folder / 'small.jpg')
+    Image.new('RGB', (900, 600), 'blue').save(folder / 'large.png')
+    Image.effect_noise((1200, 900), 64).convert('RGB').save(folder / 'cut.jpg')
+    with open(folder / 'cut.jpg', 'r+b') as f:
+        f.truncate(f.seek(0, 2) // 2)
+    (folder / 'broken.png').write_bytes(b'not an image')
+    return folder
+
+
+def test_plan_reads_headers_only(input_folder, monkeypatch):
+    def calibrate(*args):
+        raise AssertionError("calibrated without --plan")
+    monkeypatch.setattr(watermark_tool, 'calibrate_batch', calibrate)
+    monkeypatch.setattr(Image.Image, 'load', calibrate)
+
+    plan = watermark_tool.plan_batch(str(input_folder), sorted(p.name for p in input_folder.iterdir()),
+                                     CONFIG)
+    assert plan['order'] == ['cut.jpg', 'large.png', 'small.jpg']
+    assert [failure['file'] for failure in plan['rejected']] == ['broken.png']
+    assert plan['seconds'] is None
+
+
+def test_cut_off_file_fails_when_processed(tmp_path, input_folder):
+    (tmp_path / 'out').mkdir()
+    report = watermark_tool.run_batch(str(input_folder), str(tmp_path / 'out'), CONFIG)
+    assert sorted(failure['file'] for failure in report['failures']) == ['broken.png', 'cut.jpg']
+    assert report['successful'] == 2
+
+
+def test_calibrated_plan(input_folder, monkeypatch):
+    calls = []
+    monkeypatch.setattr(watermark_tool, 'calibrate_batch',
+                        lambda config, formats: calls.append(formats) or
+                        {image_format: (0.5, 1.0) for image_format in formats})
+    plan = watermark_tool.plan_batch(str(input_folder), ['small.jpg', 'large.png'], CONFIG,
+                                     calibrate=True)
+    assert calls == [['JPEG', 'PNG']]
+    assert plan['seconds'] == pytest.approx(0.5 + 0.54 + 0.5 + 0.06)
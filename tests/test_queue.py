@@ -0,0 +1,101 @@
+"""The SQLite lease queue behind --queue"""
+
+import time
+
+import pytest
+from PIL import Image
+
+import watermark_tool
+
+CONFIG = {'text': '(c) Queue', 'count': 3, 'text_opacity': 30, 'color': 'white'}
+
+
+@pytest.fixture
+def queue(tmp_path):
+    """Queue with three pending jobs, a.jpg first"""
+    conn = watermark_tool.open_queue(str(tmp_path / 'queue.db'))
+    conn.executemany("INSERT INTO jobs (file, priority) VALUES (?, ?)",
+                     [('a.jpg', 0), ('b.jpg', 1), ('c.jpg', 2)])
+    yield conn
+    conn.close()
+
+
+def job(conn, filename):
+    return conn.execute("SELECT state, attempts, lease_owner, error FROM jobs WHERE file = ?",
+                        (filename,)).fetchone()
+
+
+def test_claims_in_priority_order_once(queue):
+    claimed = [watermark_tool.claim_job(queue, f"host:1:{n}") for n in range(4)]
+    assert claimed == ['a.jpg', 'b.jpg', 'c.jpg', None]
+    assert job(queue, 'a.jpg') == ('leased', 1, 'host:1:0', None)
+
+
+def test_complete_records_outcome(queue):
+    watermark_tool.claim_job(queue, 'host:1:x')
+    watermark_tool.claim_job(queue, 'host:1:y')
+    assert watermark_tool.complete_job(queue, 'a.jpg', 'host:1:x', seconds=0.5)
+    assert watermark_tool.complete_job(queue, 'b.jpg', 'host:1:y', error="broken")
+    assert job(queue, 'a.jpg') == ('done', 1, None, None)
+    assert job(queue, 'b.jpg') == ('failed', 1, None, "broken")
+    assert queue.execute("SELECT worker FROM jobs WHERE file = 'a.jpg'").fetchone() == ('host:1',)
+
+    # Completing twice changes nothing
+    assert not watermark_tool.complete_job(queue, 'a.jpg', 'host:1:x', error="late")
+    assert job(queue, 'a.jpg') == ('done', 1, None, None)
+
+
+def test_expired_lease_is_handed_out_again(queue):
+    assert watermark_tool.claim_job(queue, 'host:1:old', lease_seconds=-1) == 'a.jpg'
+    assert watermark_tool.claim_job(queue, 'host:2:new') == 'a.jpg'
+    assert job(queue, 'a.jpg') == ('leased', 2, 'host:2:new', None)
+
+    # The first worker finishing late can't overwrite the new lease
+    assert not watermark_tool.complete_job(queue, 'a.jpg', 'host:1:old')
+    assert watermark_tool.complete_job(queue, 'a.jpg', 'host:2:new')
+
+
+def test_expired_lease_fails_after_max_attempts(queue):
+    for n in range(2):
+        assert watermark_tool.claim_job(queue, f"host:1:{n}", lease_seconds=-1,
+                                        max_attempts=2) == 'a.jpg'
+    assert watermark_tool.claim_job(queue, 'host:1:2', max_attempts=2) == 'b.jpg'
+    assert job(queue, 'a.jpg') == ('failed', 2, None, "worker stopped responding 2 time(s)")
+
+
+def test_lease_keeper_renews(tmp_path, queue):
+    watermark_tool.claim_job(queue, 'host:1:x', lease_seconds=0.3)
+    with watermark_tool.LeaseKeeper(str(tmp_path / 'queue.db'), 'host:1:x', 0.3):
+        time.sleep(0.5)
+        assert watermark_tool.claim_job(queue, 'host:2:y', lease_seconds=0.3) == 'b.jpg'
+    assert job(queue, 'a.jpg')[2] == 'host:1:x'
+
+
+def test_run_queue(tmp_path, capsys):
+    input_folder, output_folder = tmp_path / 'in', tmp_path / 'out'
+    input_folder.mkdir()
+    output_folder.mkdir()
+    for n in range(3):
+        Image.new('RGB', (200 + n, 150), (n * 60, 90, 200)).save(input_folder / f"{n}.jpg")
+    Image.new('RGB', (10, 10)).save(input_folder / 'broken.png')
+    with open(input_folder / 'broken.png', 'r+b') as f:
+        f.truncate(20)
+    queue_path = str(tmp_path / 'queue.db')
+    image_files = watermark_tool.find_image_files(str(input_folder))
+
+    report = watermark_tool.run_queue(queue_path, str(input_folder), str(output_folder),
+                                      CONFIG, image_files)
+    assert (report['successful'], report['failed'], report['remaining']) == (3, 1, 0)
+    assert sorted(path.name for path in output_folder.iterdir()) == \
+        ['0_watermarked.jpg', '1_watermarked.jpg', '2_watermarked.jpg']
+
+    # A second machine joining a drained queue has nothing left to do
+    report = watermark_tool.run_queue(queue_path, str(input_folder), str(output_folder),
+                                      CONFIG, image_files)
+    assert (report['successful'], report['failed']) == (3, 1)
+    assert "THIS MACHINE: 0 successful, 0 failed" in capsys.readouterr().out
+
+    # A queue filled for one template refuses another
+    with pytest.raises(ValueError):
+        watermark_tool.run_queue(queue_path, str(input_folder), str(output_folder),
+                                 dict(CONFIG, text="(c) Other"), image_files)
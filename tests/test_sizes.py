@@ -0,0 +1,15 @@
+"""--sizes parsing"""
+
+import pytest
+
+import watermark_tool
+
+
+def test_parse_sizes():
+    assert watermark_tool.parse_sizes('full, 2048,400px,,') == ['full', 2048, 400]
+
+
+@pytest.mark.parametrize('text', ('400xp', '400pxpx', '0', 'large'))
+def test_bad_sizes_rejected(text):
+    with pytest.raises(ValueError):
+        watermark_tool.parse_sizes(text)
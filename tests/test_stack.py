@@ -0,0 +1,50 @@
+"""blend_stack against Image.alpha_composite"""
+
+import random
+
+import pytest
+from PIL import Image
+
+import watermark_tool
+
+np = pytest.importorskip('numpy')
+
+
+def noise(rng, size, coverage):
+    """RGBA overlay with random colors and alphas on about coverage of its pixels"""
+    data = bytearray(rng.randbytes(size[0] * size[1] * 4))
+    for index in range(3, len(data), 4):
+        if rng.random() >= coverage:
+            data[index] = 0
+    return Image.frombytes('RGBA', size, bytes(data))
+
+
+@pytest.mark.parametrize('coverage', (0.0, 0.02, 0.5, 1.0))
+def test_blend_stack_matches_alpha_composite(coverage):
+    rng = random.Random(coverage)
+    size = (97, 61)
+    images = [noise(rng, size, 1.0).convert('RGB').convert('RGBA') for _ in range(6)]
+    shared = noise(rng, size, coverage)
+    # Shared runs, a lone overlay in between and one at the end
+    overlays = [shared, shared, noise(rng, size, coverage), shared, shared,
+                noise(rng, size, coverage)]
+
+    stack = np.stack([np.asarray(image) for image in images])
+    watermark_tool.blend_stack(stack, overlays)
+    for blended, image, overlay in zip(stack, images, overlays):
+        expected = np.asarray(Image.alpha_composite(image, overlay))
+        assert np.array_equal(blended, expected)
+
+
+def test_blend_stack_every_alpha():
+    # One pixel per (alpha, background, overlay color) corner
+    values = [(alpha, background, color) for alpha in range(256)
+              for background in (0, 1, 127, 128, 254, 255) for color in (0, 1, 128, 255)]
+    size = (len(values), 1)
+    overlay = Image.frombytes('RGBA', size, bytes(v for alpha, _, color in values
+                                                  for v in (color, 255 - color, color, alpha)))
+    image = Image.frombytes('RGBA', size, bytes(v for _, background, _ in values
+                                                for v in (background, background, 255 - background, 255)))
+    stack = np.asarray(image)[None].copy()
+    watermark_tool.blend_stack(stack, [overlay])
+    assert np.array_equal(stack[0], np.asarray(Image.alpha_composite(image, overlay)))